@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 import io
 
 import hmac
+import hashlib
 
 def check_password():
     """Returns `True` if the user had the correct password."""
@@ -52,14 +53,24 @@ st.set_page_config(
 # CACHING FOR PERFORMANCE
 # ============================================================
 
-@st.cache_data
-def load_and_clean_data(file_bytes, file_name):
-    """Load and clean data with caching"""
-    if file_name.endswith('.xlsx') or file_name.endswith('.xls'):
-        df = pd.read_excel(io.BytesIO(file_bytes))
-    else:
-        df = pd.read_csv(io.BytesIO(file_bytes))
-    
+# CSVs are parsed and cleaned this many rows at a time to bound peak memory
+CSV_CHUNK_ROWS = 100_000
+
+# Explicit schema for text/ID columns, used by both readers: Arrow-backed strings
+# skip per-chunk type inference, keep dtypes consistent across chunks and keep
+# leading zeros in order/item numbers. Numeric columns are left to
+# pd.to_numeric(errors='coerce') in clean_rows.
+TEXT_DTYPES = {
+    col: 'string[pyarrow]'
+    for col in ['Sales Order No', 'Item No', 'Desc', 'Sell-to Customer Name', 'Mfg. Lead Name']
+}
+
+# Filter-keyed caches hold this many recent filter combinations; each entry is a
+# filtered copy of the data (or its export bytes), so keep the bound small
+FILTER_CACHE_ENTRIES = 8
+
+def clean_rows(df):
+    """Coerce types and drop rows missing key data (safe to run per chunk)"""
     # Convert to numeric
     df['QOH'] = pd.to_numeric(df['QOH'], errors='coerce')
     df['Outstanding Amount'] = pd.to_numeric(df['Outstanding Amount'], errors='coerce')
@@ -68,183 +79,206 @@ def load_and_clean_data(file_bytes, file_name):
     if 'Outstanding Quantity' in df.columns:
         df['Outstanding Quantity'] = pd.to_numeric(df['Outstanding Quantity'], errors='coerce')
     
-    # Clean customer names
-    df['Sell-to Customer Name'] = df['Sell-to Customer Name'].astype(str).str.strip()
-    df = df[df['Sell-to Customer Name'] != '']
-    df = df[df['Sell-to Customer Name'].notna()]
-    df = df[~df['Sell-to Customer Name'].str.isdigit()]
-    
     # Clean date column if present
     if 'Requested Delivery Date' in df.columns:
         df['Requested Delivery Date'] = pd.to_datetime(df['Requested Delivery Date'], errors='coerce')
+    
+    # Clean customer names. Arrow-backed strings run strip/isin/isdigit as
+    # vectorized Arrow kernels; missing names stay <NA> and are dropped by fillna(False)
+    names = df['Sell-to Customer Name'].astype('string[pyarrow]').str.strip()
+    df['Sell-to Customer Name'] = names
+    valid_name = (
+        names.ne('') &
+        ~names.isin(['nan', 'NaN', 'None']) &
+        ~names.str.isdigit()
+    ).fillna(False)
+    
+    # Remove bad names and missing key data in one filtering copy. take() returns a
+    # frame that isn't flagged as a slice, so the loader can assign columns into it
+    has_key_data = df[['QOH', 'Outstanding Amount', 'Mfg. Lead Name']].notna().all(axis=1)
+    keep = valid_name.to_numpy(dtype=bool) & has_key_data.to_numpy()
+    return df.take(np.flatnonzero(keep))
 
-    # Remove missing key data
-    df_clean = df.dropna(subset=[
-        'QOH', 'Sell-to Customer Name', 'Outstanding Amount', 'Mfg. Lead Name'
-    ])
+@st.cache_data
+def load_and_clean_data(_file_bytes, file_key, file_name):
+    """Load and clean data with caching (keyed on the file digest, not its bytes)"""
+    # Every column is kept: the CSV/Excel exports return the full upload
+    if file_name.endswith('.xlsx') or file_name.endswith('.xls'):
+        # calamine (Rust) parses both .xlsx and legacy .xls much faster than openpyxl
+        try:
+            df = pd.read_excel(io.BytesIO(_file_bytes), engine='calamine', dtype=TEXT_DTYPES)
+        except ImportError:
+            # python-calamine not installed: use pandas' default engine for the extension
+            df = pd.read_excel(io.BytesIO(_file_bytes), dtype=TEXT_DTYPES)
+        df_clean = clean_rows(df)
+    else:
+        # Clean each chunk as it is read so dropped rows never accumulate
+        chunks = pd.read_csv(
+            io.BytesIO(_file_bytes), dtype=TEXT_DTYPES, chunksize=CSV_CHUNK_ROWS
+        )
+        df_clean = pd.concat([clean_rows(chunk) for chunk in chunks], ignore_index=True)
     
     # Calculate shortage if Outstanding Quantity exists
     if 'Outstanding Quantity' in df_clean.columns:
-        df_clean['Shortage Qty'] = df_clean.apply(
-            lambda row: max(0, row['Outstanding Quantity'] - row['QOH']) if pd.notna(row['Outstanding Quantity']) else 0,
-            axis=1
-        )
-        df_clean['Can Fulfill'] = df_clean.apply(
-            lambda row: row['QOH'] >= row['Outstanding Quantity'] if pd.notna(row['Outstanding Quantity']) else row['QOH'] > 0,
-            axis=1
-        )
+        oq = df_clean['Outstanding Quantity'].to_numpy(dtype='float64')
+        qoh = df_clean['QOH'].to_numpy(dtype='float64')
+        missing_oq = np.isnan(oq)
+        df_clean['Shortage Qty'] = np.where(missing_oq, 0, np.maximum(0, oq - qoh))
+        df_clean['Can Fulfill'] = np.where(missing_oq, qoh > 0, qoh >= oq)
+    
+    # Full back order flag (QOH == 0), computed once and reused by every view
+    df_clean['_is_bo'] = df_clean['QOH'].to_numpy() == 0
+    
+    # Downcast QOH only when every value is integral (downcast='integer' is lossless);
+    # amounts and quantities stay float64 so comparisons and exports keep exact
+    # values. Category keys let groupby/isin/== work on int codes
+    df_clean['QOH'] = pd.to_numeric(df_clean['QOH'], downcast='integer')
+    for col in ['Sell-to Customer Name', 'Mfg. Lead Name', 'Sales Order No', 'Item No']:
+        if col in df_clean.columns:
+            df_clean[col] = df_clean[col].astype('category')
     
     return df_clean
 
-# ============================================================
-# HEADER
-# ============================================================
-
-st.title("📦 Back Order Management Dashboard")
-st.markdown("*Fast back order tracking with smart shortage detection*")
-st.markdown("---")
+@st.cache_data
+def compute_masks(_file_bytes, file_key, file_name, backorder_logic, cutoff_date):
+    """Build a boolean row mask per stock category with caching"""
+    df_clean = load_and_clean_data(_file_bytes, file_key, file_name)
+    qoh = df_clean['QOH'].to_numpy()
+    is_bo = df_clean['_is_bo'].to_numpy()
+    has_stock = qoh > 0
+    
+    has_outstanding_qty = 'Outstanding Quantity' in df_clean.columns
+    if has_outstanding_qty:
+        oq = df_clean['Outstanding Quantity'].to_numpy(dtype='float64')
+        # NaN quantities compare False both ways, so they land in neither bucket
+        short = qoh < oq
+        enough = qoh >= oq
+    else:
+        short = enough = np.zeros(len(df_clean), dtype=bool)
+    
+    if backorder_logic == "Smart (QOH < Order Quantity)" and has_outstanding_qty:
+        # Smart logic: QOH < Outstanding Quantity
+        backorder, instock = short, enough
+        full, partial = is_bo, has_stock & short
+    else:
+        # Strict logic (also the fallback when Outstanding Quantity is missing).
+        # Full/partial are only offered in Smart mode, so skip building them
+        backorder, instock = is_bo, has_stock
+        full, partial = backorder, None
+    
+    # Future orders: strictly later than the cutoff day, so date-only deliveries due
+    # on the cutoff day itself are excluded (missing delivery dates compare False)
+    future = df_clean['Requested Delivery Date'].to_numpy() > np.datetime64(cutoff_date)
+    
+    return {
+        'backorder': backorder,
+        'instock': instock,
+        'full': full,
+        'partial': partial,
+        'future': future
+    }
 
-# ============================================================
-# SIDEBAR - FILE UPLOAD + SETTINGS
-# ============================================================
+def compute_customer_summary(filtered_df):
+    """Aggregate per-customer totals and counts (indexed by customer)"""
+    # Named aggregations keep each output label tied to its source column
+    aggs = {
+        'Total Outstanding': ('Outstanding Amount', 'sum'),
+        # Builtin sum over the precomputed flag stays on pandas' Cython path
+        'Full Back Orders': ('_is_bo', 'sum')
+    }
+    if 'Shortage Qty' in filtered_df.columns:
+        aggs['Total Shortage Qty'] = ('Shortage Qty', 'sum')
+    aggs['Total Items'] = ('Sales Order No', 'count')
+    
+    customer_summary = filtered_df.groupby('Sell-to Customer Name', sort=False, observed=True).agg(**aggs)
+    customer_summary = customer_summary.rename_axis('Customer')
+    return customer_summary.sort_values('Total Outstanding', ascending=False)
 
-with st.sidebar:
-    st.header("📁 Upload Data")
-    uploaded_file = st.file_uploader(
-        "Upload Excel or CSV file",
-        type=['xlsx', 'csv', 'xls'],
-        help="Upload your ELS Global Back Order file"
-    )
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def apply_filters(_df_clean, _masks, file_key, backorder_logic, cutoff_date,
+                  stock_filter, customer_min, customer_max):
+    """Filter rows and summarize in-range customers with caching (keyed on the
+    file digest and filter inputs, so the frame and masks are never hashed)"""
+    # Apply stock filter (only the selected category is sliced out of df_clean). No
+    # .copy(): boolean indexing already returns a new frame and nothing below mutates it
+    if stock_filter == "Back Order Only":
+        filtered_df = _df_clean[_masks['backorder']]
+    elif stock_filter == "Full Back Order (QOH=0)":
+        filtered_df = _df_clean[_masks['full']]
+    elif stock_filter == "Partial Shortage":
+        filtered_df = _df_clean[_masks['partial']]
+    elif stock_filter == "Can Fulfill":
+        filtered_df = _df_clean[_masks['instock']]
+    elif stock_filter == "In Stock Only":
+        filtered_df = _df_clean[_masks['instock']]
+    elif stock_filter == "Future Orders":
+        filtered_df = _df_clean[_masks['future']]
+    else:
+        filtered_df = _df_clean
     
-    st.divider()
-    st.header("⚙️ Settings")
+    # Filter by customer totals. One groupby feeds the range filter, the
+    # selector order, the detail metric and the summary table
+    customer_aggs = compute_customer_summary(filtered_df)
+    in_range = customer_aggs['Total Outstanding'].between(
+        customer_min, customer_max, inclusive='both'
+    ).to_numpy()
+    customer_aggs = customer_aggs[in_range]
     
-    # Back Order Logic Selection
-    backorder_logic = st.radio(
-        "Back Order Definition:",
-        ["Strict (QOH = 0 only)", "Smart (QOH < Order Quantity)"],
-        help="Strict: Only items with zero stock. Smart: Items with insufficient stock to fulfill order."
-    )
-
-    future_weeks = st.slider(
-        "Define 'Future Orders' cutoff (weeks from today)",
-        min_value=1,
-        max_value=12,
-        value=3,
-        help="Orders with Requested Delivery Date later than this many weeks from today."
-    )
+    # Map the per-customer decision back onto rows through the category codes.
+    # An Index lets isin reuse its hashtable
+    names = filtered_df['Sell-to Customer Name']
+    keep_category = names.cat.categories.isin(customer_aggs.index)
+    filtered_df = filtered_df[keep_category[names.cat.codes.to_numpy()]]
     
-    st.divider()
+    return filtered_df, customer_aggs
+
+@st.cache_data
+def compute_stats(_file_bytes, file_key, file_name):
+    """Compute file-level scalars once per upload with caching"""
+    df_clean = load_and_clean_data(_file_bytes, file_key, file_name)
+    customer_totals = df_clean.groupby('Sell-to Customer Name', observed=True)['Outstanding Amount'].sum()
     
-    # Dynamic info based on mode
-    if backorder_logic == "Smart (QOH < Order Quantity)":
-        st.success("""
-        **Smart Mode Active** ✨
-        - Detects partial shortages
-        - Example: QOH=10, Need=100 → Back Order
-        """)
-    else:
-        st.info("""
-        **Strict Mode Active**
-        - Only QOH = 0 items
-        - Example: QOH=10, Need=100 → NOT Back Order
-        """)
+    return {
+        'max_customer_total': float(customer_totals.max()) if len(customer_totals) else 0.0
+    }
+
+# Two CSVs (detail + summary) are cached per filter combination
+@st.cache_data(max_entries=2 * FILTER_CACHE_ENTRIES)
+def to_csv_bytes(_df, cache_key):
+    """Serialize a DataFrame to CSV bytes with caching (keyed on cache_key, not the frame)"""
+    return _df.to_csv(index=False).encode('utf-8')
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def to_excel_bytes(_df, cache_key, sheet_name):
+    """Serialize a DataFrame to .xlsx bytes with caching (keyed on cache_key, not the frame)"""
+    output = io.BytesIO()
+    # xlsxwriter is write-only and much faster than openpyxl for exports
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        _df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
 
 # ============================================================
-# MAIN CONTENT
+# ERROR HANDLING
 # ============================================================
 
-if uploaded_file is not None:
-    try:
-        file_bytes = uploaded_file.read()
-        df_clean = load_and_clean_data(file_bytes, uploaded_file.name)
-        
-        # Check if Outstanding Quantity column exists
-        has_outstanding_qty = 'Outstanding Quantity' in df_clean.columns
-        
-        # Determine back orders based on selected logic
-        if backorder_logic == "Strict (QOH = 0 only)":
-            # Original logic: Only QOH = 0
-            backorders = df_clean[df_clean['QOH'] == 0]
-            instock = df_clean[df_clean['QOH'] > 0]
-        else:
-            # Smart logic: QOH < Outstanding Quantity
-            if has_outstanding_qty:
-                backorders = df_clean[
-                    (df_clean['Outstanding Quantity'].notna()) &
-                    (df_clean['QOH'] < df_clean['Outstanding Quantity'])
-                ]
-                instock = df_clean[
-                    (df_clean['Outstanding Quantity'].notna()) &
-                    (df_clean['QOH'] >= df_clean['Outstanding Quantity'])
-                ]
-            else:
-                # Fallback to strict if column doesn't exist
-                st.warning("⚠️ 'Outstanding Quantity' column not found. Using Strict logic (QOH=0).")
-                backorders = df_clean[df_clean['QOH'] == 0]
-                instock = df_clean[df_clean['QOH'] > 0]
-        
-        # Separate categories for smart mode
-        full_backorders = df_clean[df_clean['QOH'] == 0]
-        if has_outstanding_qty:
-            partial_backorders = df_clean[
-                (df_clean['QOH'] > 0) & 
-                (df_clean['Outstanding Quantity'].notna()) &
-                (df_clean['QOH'] < df_clean['Outstanding Quantity'])
-            ]
-        else:
-            partial_backorders = pd.DataFrame()
-        
-        # Future orders
-        today = datetime.today()
-        cutoff_date = today + timedelta(weeks=future_weeks)
-        future_orders = df_clean[
-            (df_clean['Requested Delivery Date'].notna()) &
-            (df_clean['Requested Delivery Date'] >= cutoff_date)
-        ]
-        
-        # ============================================================
-        # SUMMARY METRICS
-        # ============================================================
+def show_error(e):
+    """Show a processing error along with the expected file columns"""
+    st.error(f"❌ Error: {str(e)}")
+    st.write("Please ensure your file has these columns:")
+    st.write("- QOH, Sell-to Customer Name, Outstanding Amount, Mfg. Lead Name")
+    st.write("- Outstanding Quantity (optional, for Smart mode)")
 
-        if backorder_logic == "Smart (QOH < Order Quantity)" and has_outstanding_qty:
-            # Enhanced metrics for smart mode
-            col1, col2, col3, col4, col5 = st.columns(5)
-            
-            with col1:
-                st.metric("Back Order Items", len(backorders),
-                          f"{(len(backorders) / len(df_clean) * 100):.1f}%")
-            with col2:
-                st.metric("Full Back Orders", len(full_backorders),
-                          delta="QOH = 0")
-            with col3:
-                st.metric("Partial Shortages", len(partial_backorders),
-                          delta="QOH < Needed")
-            with col4:
-                st.metric("Back Order Value",
-                          f"${backorders['Outstanding Amount'].sum():,.0f}")
-            with col5:
-                st.metric("Can Fulfill",
-                          f"${instock['Outstanding Amount'].sum():,.0f}")
-        else:
-            # Standard metrics for strict mode
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                st.metric("Back Order Items", len(backorders),
-                          f"{(len(backorders) / len(df_clean) * 100):.1f}%")
-            with col2:
-                st.metric("Back Order Value",
-                          f"${backorders['Outstanding Amount'].sum():,.0f}")
-            with col3:
-                st.metric("In-Stock Value",
-                          f"${instock['Outstanding Amount'].sum():,.0f}")
-            with col4:
-                st.metric("Unique Customers",
-                          df_clean['Sell-to Customer Name'].nunique())
-        
-        st.markdown("---")
-        
+# ============================================================
+# CUSTOMER VIEWS (FRAGMENT)
+# ============================================================
+
+@st.fragment
+def render_customer_views(df_clean, masks, file_key, backorder_logic, cutoff_date,
+                          has_outstanding_qty, max_customer_total):
+    """Render filters, customer tables and exports; widget changes rerun only this part"""
+    # Errors inside a fragment rerun never reach the script-level handler, so
+    # the fragment needs its own
+    try:
         # ============================================================
         # FILTERS
         # ============================================================
@@ -267,49 +301,40 @@ if uploaded_file is not None:
             )
         
         with col3:
+            # Default high enough that no customer is hidden on first load
             customer_max = st.number_input(
-                "Customer Max. Total $", min_value=0, value=1000000, step=1000
+                "Customer Max. Total $", min_value=0,
+                value=max(1000000, int(np.ceil(max_customer_total))), step=1000
             )
         
-        # Apply stock filter
-        if stock_filter == "Back Order Only":
-            filtered_df = backorders.copy()
-        elif stock_filter == "Full Back Order (QOH=0)":
-            filtered_df = full_backorders.copy()
-        elif stock_filter == "Partial Shortage":
-            filtered_df = partial_backorders.copy()
-        elif stock_filter == "Can Fulfill":
-            filtered_df = instock.copy()
-        elif stock_filter == "In Stock Only":
-            filtered_df = instock.copy()
-        elif stock_filter == "Future Orders":
-            filtered_df = future_orders.copy()
-        else:
-            filtered_df = df_clean.copy()
-        
-        # Filter by customer totals
-        customer_totals = filtered_df.groupby('Sell-to Customer Name')['Outstanding Amount'].sum()
-        valid_customers = customer_totals[
-            (customer_totals >= customer_min) & (customer_totals <= customer_max)
-        ].index.tolist()
-        filtered_df = filtered_df[filtered_df['Sell-to Customer Name'].isin(valid_customers)]
+        # Cached per file + filter settings, so reruns that don't touch the filters
+        # (e.g. picking a customer below) skip the slice and groupby. The same key
+        # identifies the export bytes
+        filter_key = (file_key, backorder_logic, cutoff_date, stock_filter, customer_min, customer_max)
+        filtered_df, customer_aggs = apply_filters(df_clean, masks, *filter_key)
+        customer_totals = customer_aggs['Total Outstanding']
+        valid_customers = customer_aggs.index
         
         # Explanation expander
         with st.expander("ℹ️ Understanding Back Order Logic"):
+            # One markdown element per mode instead of one st.write per line
             if backorder_logic == "Strict (QOH = 0 only)":
-                st.write("**Current Mode: STRICT** 🔒")
-                st.write("- Back Order = QOH equals 0 (completely out of stock)")
-                st.write("- Example: QOH=10, Need=100 → **NOT** a back order")
-                st.write("- Use this if you only care about items with zero stock")
+                st.markdown(
+                    "**Current Mode: STRICT** 🔒\n\n"
+                    "- Back Order = QOH equals 0 (completely out of stock)\n"
+                    "- Example: QOH=10, Need=100 → **NOT** a back order\n"
+                    "- Use this if you only care about items with zero stock"
+                )
             else:
-                st.write("**Current Mode: SMART** 🧠")
-                st.write("- Back Order = QOH < Outstanding Quantity (insufficient stock)")
-                st.write("- Example: QOH=10, Need=100 → **IS** a back order (shortage of 90)")
-                st.write("")
-                st.write("**Categories:**")
-                st.write("- 🔴 Full Back Order: QOH = 0 (no stock at all)")
-                st.write("- 🟡 Partial Shortage: QOH > 0 but < Needed (some stock, not enough)")
-                st.write("- 🟢 Can Fulfill: QOH >= Needed (sufficient stock)")
+                st.markdown(
+                    "**Current Mode: SMART** 🧠\n\n"
+                    "- Back Order = QOH < Outstanding Quantity (insufficient stock)\n"
+                    "- Example: QOH=10, Need=100 → **IS** a back order (shortage of 90)\n\n"
+                    "**Categories:**\n\n"
+                    "- 🔴 Full Back Order: QOH = 0 (no stock at all)\n"
+                    "- 🟡 Partial Shortage: QOH > 0 but < Needed (some stock, not enough)\n"
+                    "- 🟢 Can Fulfill: QOH >= Needed (sufficient stock)"
+                )
         
         st.markdown("---")
         
@@ -317,31 +342,20 @@ if uploaded_file is not None:
         # CUSTOMER TABLE VIEW
         # ============================================================
 
+        # Built even when nothing matches, so the summary export stays available
+        customer_summary = customer_aggs.reset_index()
+        
         if len(filtered_df) > 0:
             st.subheader(f"📊 Orders by Customer ({len(valid_customers)} customers)")
             
-            # Build aggregation based on available columns
-            agg_dict = {
-                'Outstanding Amount': 'sum',
-                'QOH': lambda x: (x == 0).sum(),
-                'Sales Order No': 'count'
-            }
-            
-            if 'Shortage Qty' in filtered_df.columns:
-                agg_dict['Shortage Qty'] = 'sum'
-            
-            customer_summary = filtered_df.groupby('Sell-to Customer Name').agg(agg_dict).reset_index()
-            
-            # Rename columns
-            col_names = ['Customer', 'Total Outstanding', 'Full Back Orders', 'Total Items']
-            if 'Shortage Qty' in filtered_df.columns:
-                col_names.insert(3, 'Total Shortage Qty')
-            
-            customer_summary.columns = col_names
-            customer_summary = customer_summary.sort_values('Total Outstanding', ascending=False)
-            customer_summary['Total Outstanding'] = customer_summary['Total Outstanding'].apply(lambda x: f"${x:,.2f}")
-            
-            st.dataframe(customer_summary, use_container_width=True, hide_index=True)
+            st.dataframe(
+                customer_summary,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    'Total Outstanding': st.column_config.NumberColumn(format="dollar")
+                }
+            )
             st.markdown("---")
             
             # ============================================================
@@ -359,20 +373,20 @@ if uploaded_file is not None:
             if selected_customer:
                 customer_df = filtered_df[filtered_df['Sell-to Customer Name'] == selected_customer]
                 
-                # Metrics
+                # Metrics (total reuses the precomputed customer_totals)
                 col1, col2, col3, col4 = st.columns(4)
                 with col1:
-                    st.metric("Total Outstanding", f"${customer_df['Outstanding Amount'].sum():,.2f}")
+                    st.metric("Total Outstanding", f"${customer_totals[selected_customer]:,.2f}")
                 with col2:
                     st.metric("Total Items", len(customer_df))
                 with col3:
-                    st.metric("Full Back Orders", len(customer_df[customer_df['QOH'] == 0]))
+                    st.metric("Full Back Orders", int(customer_df['_is_bo'].sum()))
                 with col4:
                     if 'Shortage Qty' in customer_df.columns:
                         total_shortage = customer_df['Shortage Qty'].sum()
                         st.metric("Total Shortage Units", f"{int(total_shortage)}")
                     else:
-                        st.metric("In Stock", len(customer_df[customer_df['QOH'] > 0]))
+                        st.metric("In Stock", int((customer_df['QOH'] > 0).sum()))
                 
                 st.markdown("---")
                 
@@ -386,9 +400,7 @@ if uploaded_file is not None:
                 
                 display_cols.extend(['Requested Delivery Date', 'Mfg. Lead Name'])
                 
-                display_df = customer_df[display_cols].copy()
-                
-                # Rename columns
+                # Rename columns (rename already returns a new frame, so no extra .copy())
                 col_rename = {
                     'Sales Order No': 'Order #',
                     'Item No': 'Item #',
@@ -399,24 +411,32 @@ if uploaded_file is not None:
                     'Requested Delivery Date': 'Delivery Date',
                     'Mfg. Lead Name': 'Mfg Lead'
                 }
-                display_df.columns = [col_rename.get(c, c) for c in display_df.columns]
+                display_df = customer_df[display_cols].rename(columns=col_rename)
                 
-                # Add status column
+                # Truncate long descriptions for display (exports keep the full text)
+                display_df['Description'] = display_df['Description'].str.slice(0, 80)
+                
+                # Add status column (vectorized; NaN Qty Needed compares False -> CAN FULFILL)
+                qoh_v = display_df['QOH'].to_numpy()
                 if 'Qty Needed' in display_df.columns and backorder_logic == "Smart (QOH < Order Quantity)":
-                    display_df['Status'] = display_df.apply(
-                        lambda row: '🔴 FULL BACK ORDER' if row['QOH'] == 0 
-                        else ('🟡 PARTIAL SHORTAGE' if pd.notna(row.get('Qty Needed')) and row['QOH'] < row['Qty Needed']
-                        else '🟢 CAN FULFILL'),
-                        axis=1
+                    need_v = display_df['Qty Needed'].to_numpy(dtype='float64')
+                    display_df['Status'] = np.select(
+                        [qoh_v == 0, qoh_v < need_v],
+                        ['🔴 FULL BACK ORDER', '🟡 PARTIAL SHORTAGE'],
+                        default='🟢 CAN FULFILL'
                     )
                 else:
-                    display_df['Status'] = display_df['QOH'].apply(
-                        lambda x: '🔴 BACK ORDER' if x == 0 else '🟢 IN STOCK'
-                    )
+                    display_df['Status'] = np.where(qoh_v == 0, '🔴 BACK ORDER', '🟢 IN STOCK')
                 
-                display_df['Outstanding $'] = display_df['Outstanding $'].apply(lambda x: f"${x:,.2f}")
-                
-                st.dataframe(display_df, use_container_width=True, hide_index=True)
+                # Currency is formatted client-side so the column stays numeric (and sortable)
+                st.dataframe(
+                    display_df,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        'Outstanding $': st.column_config.NumberColumn(format="dollar")
+                    }
+                )
         
         else:
             st.info("No customers match your filters. Adjust filter settings above.")
@@ -429,10 +449,13 @@ if uploaded_file is not None:
 
         st.subheader("📥 Export Data")
         
+        # Internal helper columns (prefixed with '_') are not part of the export
+        export_df = filtered_df.drop(columns=[c for c in filtered_df.columns if c.startswith('_')])
+        
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            csv_data = filtered_df.to_csv(index=False)
+            csv_data = to_csv_bytes(export_df, (filter_key, 'detail'))
             st.download_button(
                 label="📄 Download as CSV",
                 data=csv_data,
@@ -441,31 +464,164 @@ if uploaded_file is not None:
             )
         
         with col2:
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                filtered_df.to_excel(writer, index=False, sheet_name='Back Orders')
-            output.seek(0)
             st.download_button(
                 label="📊 Download as Excel",
-                data=output,
+                data=to_excel_bytes(export_df, filter_key, 'Back Orders'),
                 file_name=f"back_orders_{datetime.now().strftime('%Y%m%d')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
         
         with col3:
-            csv_summary = customer_summary.to_csv(index=False)
+            csv_summary = to_csv_bytes(customer_summary, (filter_key, 'summary'))
             st.download_button(
                 label="📋 Download Summary",
                 data=csv_summary,
                 file_name=f"customer_summary_{datetime.now().strftime('%Y%m%d')}.csv",
                 mime="text/csv"
             )
+        
+    except Exception as e:
+        show_error(e)
+
+# ============================================================
+# HEADER
+# ============================================================
+
+st.title("📦 Back Order Management Dashboard")
+st.markdown("*Fast back order tracking with smart shortage detection*")
+st.markdown("---")
+
+# ============================================================
+# SIDEBAR - FILE UPLOAD + SETTINGS
+# ============================================================
+
+with st.sidebar:
+    st.header("📁 Upload Data")
+    uploaded_file = st.file_uploader(
+        "Upload Excel or CSV file",
+        type=['xlsx', 'csv', 'xls'],
+        help="Upload your ELS Global Back Order file"
+    )
+    
+    st.divider()
+    st.header("⚙️ Settings")
+    
+    # Back Order Logic Selection
+    backorder_logic = st.radio(
+        "Back Order Definition:",
+        ["Strict (QOH = 0 only)", "Smart (QOH < Order Quantity)"],
+        help="Strict: Only items with zero stock. Smart: Items with insufficient stock to fulfill order."
+    )
+
+    future_weeks = st.slider(
+        "Define 'Future Orders' cutoff (weeks from today)",
+        min_value=1,
+        max_value=12,
+        value=3,
+        help="Orders with Requested Delivery Date later than this many weeks from today."
+    )
+    
+    st.divider()
+    
+    # Dynamic info based on mode
+    if backorder_logic == "Smart (QOH < Order Quantity)":
+        st.success("""
+        **Smart Mode Active** ✨
+        - Detects partial shortages
+        - Example: QOH=10, Need=100 → Back Order
+        """)
+    else:
+        st.info("""
+        **Strict Mode Active**
+        - Only QOH = 0 items
+        - Example: QOH=10, Need=100 → NOT Back Order
+        """)
+
+# ============================================================
+# MAIN CONTENT
+# ============================================================
+
+if uploaded_file is not None:
+    try:
+        # getvalue() doesn't move the read cursor, so reruns see the same bytes
+        file_bytes = uploaded_file.getvalue()
+        # Hash the upload once per rerun; the cached loaders key on this digest
+        # and skip hashing the raw bytes themselves (underscore parameters)
+        file_key = hashlib.md5(file_bytes).hexdigest()
+        df_clean = load_and_clean_data(file_bytes, file_key, uploaded_file.name)
+        
+        stats = compute_stats(file_bytes, file_key, uploaded_file.name)
+        
+        # Check if Outstanding Quantity column exists
+        has_outstanding_qty = 'Outstanding Quantity' in df_clean.columns
+        
+        if backorder_logic == "Smart (QOH < Order Quantity)" and not has_outstanding_qty:
+            # Fallback to strict if column doesn't exist
+            st.warning("⚠️ 'Outstanding Quantity' column not found. Using Strict logic (QOH=0).")
+        
+        # Cutoff at day granularity so the masks stay cached for the whole day
+        cutoff_date = datetime.today().date() + timedelta(weeks=future_weeks)
+        
+        # Category masks (cached per file + settings); frames are only sliced
+        # out for the view that is actually shown
+        masks = compute_masks(file_bytes, file_key, uploaded_file.name, backorder_logic, cutoff_date)
+        
+        amounts = df_clean['Outstanding Amount'].to_numpy()
+        backorder_count = int(masks['backorder'].sum())
+        backorder_value = amounts[masks['backorder']].sum()
+        instock_value = amounts[masks['instock']].sum()
+        
+        # ============================================================
+        # SUMMARY METRICS
+        # ============================================================
+
+        if backorder_logic == "Smart (QOH < Order Quantity)" and has_outstanding_qty:
+            # Enhanced metrics for smart mode
+            col1, col2, col3, col4, col5 = st.columns(5)
+            
+            with col1:
+                st.metric("Back Order Items", backorder_count,
+                          f"{(backorder_count / len(df_clean) * 100):.1f}%")
+            with col2:
+                st.metric("Full Back Orders", int(masks['full'].sum()),
+                          delta="QOH = 0")
+            with col3:
+                st.metric("Partial Shortages", int(masks['partial'].sum()),
+                          delta="QOH < Needed")
+            with col4:
+                st.metric("Back Order Value",
+                          f"${backorder_value:,.0f}")
+            with col5:
+                st.metric("Can Fulfill",
+                          f"${instock_value:,.0f}")
+        else:
+            # Standard metrics for strict mode
+            col1, col2, col3, col4 = st.columns(4)
+            
+            with col1:
+                st.metric("Back Order Items", backorder_count,
+                          f"{(backorder_count / len(df_clean) * 100):.1f}%")
+            with col2:
+                st.metric("Back Order Value",
+                          f"${backorder_value:,.0f}")
+            with col3:
+                st.metric("In-Stock Value",
+                          f"${instock_value:,.0f}")
+            with col4:
+                # Categories are built from the cleaned rows, so every one is observed
+                st.metric("Unique Customers",
+                          len(df_clean['Sell-to Customer Name'].cat.categories))
+        
+        st.markdown("---")
+        
+        # Filter / selector / export widgets rerun only this fragment, not the prep above
+        render_customer_views(
+            df_clean, masks, file_key, backorder_logic, cutoff_date,
+            has_outstanding_qty, stats['max_customer_total']
+        )
     
     except Exception as e:
-        st.error(f"❌ Error: {str(e)}")
-        st.write("Please ensure your file has these columns:")
-        st.write("- QOH, Sell-to Customer Name, Outstanding Amount, Mfg. Lead Name")
-        st.write("- Outstanding Quantity (optional, for Smart mode)")
+        show_error(e)
 
 else:
     st.info(